@@ -6,12 +6,22 @@ so no real `claude -p` invocation happens. Run with:
 
     python3 -m unittest test_file_sort.py -v
 """
+import csv
 import importlib.util
+import io
+import json
+import logging
 import shutil
+import string
 import sys
 import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
+from types import SimpleNamespace
 from unittest.mock import patch
 
 # The script's filename has a hyphen so we can't `import file-sort` directly.
@@ -161,6 +171,106 @@ class TestResponseParsing(unittest.TestCase):
         )
 
 
+class TestSanitizeFilename(unittest.TestCase):
+    def test_strips_explanation_and_collapses_whitespace(self):
+        self.assertEqual(
+            file_sort.sanitize_filename('"2025-01-15 -   Electric   Bill"\nThis name uses the due date.'),
+            "2025-01-15 - Electric Bill.pdf",
+        )
+
+    def test_already_named_pattern_accepts_year_only(self):
+        self.assertTrue(file_sort._ALREADY_NAMED_RE.match("2024 - Tax Return.pdf"))
+        self.assertTrue(file_sort._ALREADY_NAMED_RE.match("2024-03-01 - Lease.pdf"))
+        self.assertFalse(file_sort._ALREADY_NAMED_RE.match("scan001.pdf"))
+
+
+class TestPromptTemplates(unittest.TestCase):
+    TEMPLATES = [
+        "ROOT_PICK_PROMPT_TEMPLATE",
+        "SUBTREE_PICK_PROMPT_TEMPLATE",
+        "FILENAME_GENERATION_PROMPT_TEMPLATE",
+        "CLASSIFY_AND_NAME_PROMPT_TEMPLATE",
+    ]
+
+    def test_placeholders_follow_the_fixed_rubric(self):
+        # Everything before the first placeholder must be static, and the
+        # first placeholder must open a data section, so the rubric is a
+        # cacheable prefix shared by every call.
+        for name in self.TEMPLATES:
+            template = getattr(file_sort, name)
+            prefix = next(string.Formatter().parse(template))[0]
+            with self.subTest(name):
+                self.assertTrue(prefix.rstrip("\n").endswith("==="), prefix[-80:])
+                self.assertIn("rules", prefix.lower())
+
+    def test_document_prompts_treat_contents_as_data(self):
+        for name in ["FILENAME_GENERATION_PROMPT_TEMPLATE", "CLASSIFY_AND_NAME_PROMPT_TEMPLATE"]:
+            template = getattr(file_sort, name)
+            with self.subTest(name):
+                self.assertIn("CRITICAL SYSTEM INSTRUCTIONS:", template)
+                self.assertIn("not instructions for you", template)
+                self.assertIn("IMPORTANT EXAMPLES:", template)
+
+
+class TestClassifyAndNameParsing(unittest.TestCase):
+    def test_parses_fenced_json(self):
+        self.assertEqual(
+            file_sort.parse_classify_and_name_response(
+                'Here you go:\n```json\n{"path": "Medical/Oliver/", "filename": "2025-06-01 - Lab"}\n```',
+                "Medical",
+            ),
+            ("Medical/Oliver", "2025-06-01 - Lab"),
+        )
+
+    def test_path_outside_root_is_rejected(self):
+        self.assertEqual(
+            file_sort.parse_classify_and_name_response(
+                '{"path": "Financial/Bills", "filename": "2025-06-01 - Lab"}', "Medical"
+            ),
+            (None, "2025-06-01 - Lab"),
+        )
+
+    def test_non_json_returns_nothing(self):
+        self.assertEqual(
+            file_sort.parse_classify_and_name_response("Medical/Oliver", "Medical"),
+            (None, None),
+        )
+
+
+class TestPackForPrompt(unittest.TestCase):
+    def test_short_text_is_unchanged(self):
+        self.assertEqual(file_sort._pack_for_prompt("short", head=3, tail=2), "short")
+
+    def test_long_text_keeps_head_and_tail(self):
+        text = "Invoice 2025-01-15 " + "x" * 10000 + " Total due $42.00"
+        packed = file_sort._pack_for_prompt(text)
+        self.assertTrue(packed.startswith("Invoice 2025-01-15"))
+        self.assertTrue(packed.endswith("Total due $42.00"))
+        self.assertLessEqual(len(packed), file_sort.PROMPT_FILE_CONTENT_MAX_LENGTH + len("\n...\n"))
+
+
+class TestFilterProblematicContent(unittest.TestCase):
+    def test_removes_question_prompts(self):
+        text = "Invoice total $42.00. Need help? Could you clarify what you mean by totals? Paid in full"
+        filtered = file_sort.filter_problematic_content(text)
+        self.assertNotIn("Need help", filtered)
+        self.assertNotIn("clarify", filtered)
+        self.assertIn("Invoice total $42.00", filtered)
+        self.assertIn("Paid in full", filtered)
+
+    def test_overlapping_patterns_are_applied_in_order(self):
+        # "Need help?" is removed first, which lets "How to ...?" reach the
+        # next question mark
+        text = "How to pay: Need help? Call 555-0100 for a refund?"
+        self.assertEqual(file_sort.filter_problematic_content(text), "")
+
+    def test_replaces_trigger_word_data(self):
+        self.assertEqual(
+            file_sort.filter_problematic_content("Payment verification DATA attached"),
+            "Payment verification information attached",
+        )
+
+
 class TestBuildAnnotatedTree(unittest.TestCase):
     def setUp(self):
         self.tmp = Path(tempfile.mkdtemp())
@@ -194,6 +304,128 @@ class TestBuildAnnotatedTree(unittest.TestCase):
         self.assertNotIn("pattern", tree)
 
 
+class TestCheckFileDownloaded(unittest.TestCase):
+    def test_dataless_flag_means_not_downloaded(self):
+        st = SimpleNamespace(st_flags=file_sort._SF_DATALESS)
+        with patch.object(file_sort.os, "stat", return_value=st), \
+                patch.object(file_sort.subprocess, "run") as run:
+            self.assertFalse(file_sort.check_file_downloaded(Path("scan.pdf")))
+        run.assert_not_called()
+
+    def test_materialized_file_is_downloaded(self):
+        st = SimpleNamespace(st_flags=0)
+        with patch.object(file_sort.os, "stat", return_value=st):
+            self.assertTrue(file_sort.check_file_downloaded(Path("scan.pdf")))
+
+
+class _PdfDict(dict):
+    """Stand-in for a PyPDF2 DictionaryObject."""
+
+    def get_object(self):
+        return self
+
+
+class TestPageHasTextLayer(unittest.TestCase):
+    def test_page_with_fonts_has_text_layer(self):
+        page = _PdfDict({"/Resources": _PdfDict({"/Font": _PdfDict({"/F1": _PdfDict()})})})
+        self.assertTrue(file_sort._page_has_text_layer(page))
+
+    def test_scanned_page_with_only_images_has_no_text_layer(self):
+        image = _PdfDict({"/Subtype": "/Image"})
+        page = _PdfDict({"/Resources": _PdfDict({"/XObject": _PdfDict({"/Im0": image})})})
+        self.assertFalse(file_sort._page_has_text_layer(page))
+
+    def test_form_xobject_counts_as_text_layer(self):
+        form = _PdfDict({"/Subtype": "/Form"})
+        page = _PdfDict({"/Resources": _PdfDict({"/XObject": _PdfDict({"/Fm0": form})})})
+        self.assertTrue(file_sort._page_has_text_layer(page))
+
+
+class _PdfPage(_PdfDict):
+    """Stand-in for a PyPDF2 page with a text layer."""
+
+    def __init__(self, text):
+        super().__init__({"/Resources": _PdfDict({"/Font": _PdfDict({"/F1": _PdfDict()})})})
+        self.text = text
+        self.extracted = False
+
+    def extract_text(self):
+        self.extracted = True
+        return self.text
+
+
+class TestExtractTextFromPdf(unittest.TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.pdf = self.tmp / "scan.pdf"
+        self.pdf.write_bytes(b"%PDF-1.4")
+        self.patches = [
+            patch.object(file_sort, "log_print"),
+            patch.object(file_sort, "ensure_file_downloaded", return_value=True),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in reversed(self.patches):
+            p.stop()
+        shutil.rmtree(self.tmp)
+
+    def _extract(self, pages):
+        fake_pypdf2 = SimpleNamespace(PdfReader=lambda file, strict: SimpleNamespace(pages=pages))
+        with patch.dict(sys.modules, {"PyPDF2": fake_pypdf2}):
+            return file_sort.extract_text_from_pdf(self.pdf)
+
+    def test_long_pdf_keeps_last_page_footer(self):
+        pages = [_PdfPage(f"Page {i} " + "x" * 3000) for i in range(5)]
+        pages[-1].text = "Statement page 5\nTOTAL DUE $42.00\nSigned, J. Smith"
+        text = self._extract(pages)
+        self.assertLessEqual(len(text), file_sort.EXTRACT_MAX_CHARS)
+        self.assertTrue(text.startswith("Page 0"))
+        self.assertTrue(text.endswith("Signed, J. Smith"))
+        self.assertIn("TOTAL DUE $42.00", file_sort._pack_for_prompt(text))
+        # Middle pages are still skipped
+        self.assertFalse(pages[2].extracted or pages[3].extracted)
+
+    def test_dense_single_page_keeps_its_footer(self):
+        page = _PdfPage("Statement " + "x" * 7000 + "\nTOTAL DUE $42.00")
+        text = self._extract([page])
+        self.assertLessEqual(len(text), file_sort.EXTRACT_MAX_CHARS)
+        self.assertTrue(text.startswith("Statement"))
+        self.assertIn("TOTAL DUE $42.00", file_sort._pack_for_prompt(text))
+
+    def test_short_pdf_is_returned_whole(self):
+        pages = [_PdfPage("Electric bill for January, account 1234-5678"), _PdfPage("TOTAL DUE $42.00")]
+        self.assertEqual(self._extract(pages), "Electric bill for January, account 1234-5678\nTOTAL DUE $42.00")
+
+
+class TestEnsureFileDownloaded(unittest.TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.pdf = self.tmp / "scan.pdf"
+        self.pdf.write_bytes(b"%PDF-1.4 test")
+        self.log_patch = patch.object(file_sort, "log_print")
+        self.log_patch.start()
+
+    def tearDown(self):
+        self.log_patch.stop()
+        shutil.rmtree(self.tmp)
+
+    def test_readable_local_file_skips_brctl(self):
+        with patch.object(file_sort, "check_file_downloaded", return_value=True), \
+                patch.object(file_sort.subprocess, "run") as run:
+            self.assertTrue(file_sort.ensure_file_downloaded(self.pdf))
+        run.assert_not_called()
+
+    def test_wait_until_readable_returns_immediately_for_local_file(self):
+        with patch.object(file_sort.time, "sleep") as sleep:
+            self.assertTrue(file_sort._wait_until_readable(self.pdf, timeout=2))
+        sleep.assert_not_called()
+
+    def test_wait_until_readable_gives_up_after_timeout(self):
+        self.assertFalse(file_sort._wait_until_readable(self.tmp / "missing.pdf", timeout=0))
+
+
 class TestClassifyEndToEnd(unittest.TestCase):
     """End-to-end test of classify_file_category with call_claude mocked."""
 
@@ -228,8 +460,18 @@ class TestClassifyEndToEnd(unittest.TestCase):
         self.path_patch.start()
         self.log_patch = patch.object(file_sort, "log_print")
         self.log_patch.start()
+        self.rules_path = self.tmp / "config" / "rules.json"
+        self.cache_patches = [
+            patch.object(file_sort, "LLM_CACHE_PATH", self.tmp / "cache" / "llm_cache.json"),
+            patch.object(file_sort, "_LLM_CACHE", None),
+            patch.object(file_sort, "CLASSIFY_RULES_PATH", self.rules_path),
+        ]
+        for p in self.cache_patches:
+            p.start()
 
     def tearDown(self):
+        for p in reversed(self.cache_patches):
+            p.stop()
         self.log_patch.stop()
         self.path_patch.stop()
         shutil.rmtree(self.tmp)
@@ -301,5 +543,467 @@ class TestClassifyEndToEnd(unittest.TestCase):
         self.assertEqual(dest, self.tmp / "Misc.")
 
 
+    def test_classify_and_name_uses_one_stage_two_call(self):
+        reply = '```json\n{"path": "Financial/Bills/Electric", "filename": "2025-01-15 - Electric Bill"}\n```'
+        with patch.object(
+            file_sort, "call_claude",
+            side_effect=self._mock_claude("Financial", reply),
+        ) as claude:
+            dest, filename = file_sort.classify_and_name(
+                "Electric bill", created_date="2025-01-20"
+            )
+        self.assertEqual(dest, self.tmp / "Financial" / "Bills" / "Electric")
+        self.assertEqual(filename, "2025-01-15 - Electric Bill.pdf")
+        self.assertEqual(claude.call_count, 2)
+
+    def test_classify_and_name_asks_separately_without_filename(self):
+        with patch.object(
+            file_sort, "call_claude",
+            side_effect=self._mock_claude(
+                "Medical", '{"path": "Medical/Oliver"}', "2025-06-01 - Oliver Lab Results"
+            ),
+        ):
+            dest, filename = file_sort.classify_and_name(
+                "Lab results for Oliver", created_date="2025-06-01"
+            )
+        self.assertEqual(dest, self.tmp / "Medical" / "Oliver")
+        self.assertEqual(filename, "2025-06-01 - Oliver Lab Results.pdf")
+
+    def test_classify_and_name_reuses_cached_result(self):
+        reply = '{"path": "Financial/Bills/Electric", "filename": "2025-01-15 - Electric Bill"}'
+        with patch.object(
+            file_sort, "call_claude",
+            side_effect=self._mock_claude("Financial", reply),
+        ) as claude:
+            first = file_sort.classify_and_name("Electric bill", created_date="2025-01-20")
+            # Fresh process: the result must come back from disk
+            file_sort._LLM_CACHE = None
+            second = file_sort.classify_and_name("Electric bill", created_date="2025-01-20")
+        self.assertEqual(first, second)
+        self.assertEqual(claude.call_count, 2)
+
+    def test_prompt_edit_retires_cached_results(self):
+        reply = '{"path": "Financial/Bills/Electric", "filename": "2025-01-15 - Electric Bill"}'
+        with patch.object(
+            file_sort, "call_claude",
+            side_effect=self._mock_claude("Financial", reply),
+        ):
+            file_sort.classify_and_name("Electric bill", created_date="2025-01-20")
+        self.assertIsNotNone(file_sort.cache_lookup("Electric bill", "2025-01-20"))
+        edited = file_sort.CLASSIFY_AND_NAME_PROMPT_TEMPLATE + "\n- A new destination rule."
+        with patch.object(file_sort, "CLASSIFY_AND_NAME_PROMPT_TEMPLATE", edited):
+            self.assertIsNone(file_sort.cache_lookup("Electric bill", "2025-01-20"))
+
+    def test_fallback_results_are_not_cached(self):
+        with patch.object(
+            file_sort, "call_claude",
+            side_effect=self._mock_claude(None, "2025-06-01 - Document"),
+        ):
+            file_sort.classify_and_name("Document", created_date="2025-06-01")
+        self.assertIsNone(file_sort.cache_lookup("Document", "2025-06-01"))
+        self.assertFalse(file_sort.LLM_CACHE_PATH.exists())
+
+    def _write_rules(self, rules):
+        self.rules_path.parent.mkdir()
+        self.rules_path.write_text(json.dumps(rules), encoding="utf-8")
+
+    def test_matching_rule_skips_classification_calls(self):
+        self._write_rules([
+            {"pattern": "(", "destination": "Misc."},  # malformed, skipped
+            {"pattern": r"pacific gas", "destination": "Financial/Bills/Gas"},
+        ])
+        with patch.object(
+            file_sort, "call_claude",
+            side_effect=self._mock_claude("2025-01-15 - PG&E Gas Bill"),
+        ) as claude:
+            dest, filename = file_sort.classify_and_name(
+                "PACIFIC GAS AND ELECTRIC statement", created_date="2025-01-20"
+            )
+        self.assertEqual(dest, self.tmp / "Financial" / "Bills" / "Gas")
+        self.assertEqual(filename, "2025-01-15 - PG&E Gas Bill.pdf")
+        self.assertEqual(claude.call_count, 1)
+
+    def test_rule_with_invalid_destination_is_ignored(self):
+        self._write_rules([{"pattern": "electric", "destination": "Financial/Bills/Sewage"}])
+        self.assertIsNone(file_sort.classify_by_rules("Electric bill"))
+
+
+class TestLogFileMove(unittest.TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.log_file_path = self.tmp / "file_move_log.csv"
+        self.patches = [
+            patch.object(file_sort, "log_print"),
+            patch.object(file_sort, "_nudge_icloud"),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in reversed(self.patches):
+            p.stop()
+        shutil.rmtree(self.tmp)
+
+    def _log_moves(self, *names):
+        with file_sort.open_move_log(self.log_file_path) as f:
+            writer = csv.writer(f)
+            for name in names:
+                file_sort.log_file_move(writer, name, name.upper(), "Misc.")
+
+    def _rows(self):
+        with open(self.log_file_path, newline="", encoding="utf-8") as f:
+            return list(csv.reader(f))
+
+    def test_appends_rows_after_single_header(self):
+        self._log_moves("a.pdf")
+        self._log_moves("b.pdf")
+        rows = self._rows()
+        self.assertEqual(rows[0], file_sort.CSV_LOG_HEADER)
+        self.assertEqual([r[1] for r in rows[1:]], ["a.pdf", "b.pdf"])
+
+    def test_timestamp_keeps_existing_format(self):
+        self._log_moves("a.pdf")
+        timestamp = self._rows()[1][0]
+        self.assertEqual(len(timestamp), 19)
+        datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
+
+    def test_upgrades_legacy_newest_first_log(self):
+        self.log_file_path.write_text(
+            "DateTime,Old Filename,New Filename,Destination\n"
+            "2025-02-01 10:00:00,new.pdf,New.pdf,Misc.\n"
+            "2025-01-01 10:00:00,old.pdf,Old.pdf,Misc.\n",
+            encoding="utf-8",
+        )
+        self._log_moves("c.pdf")
+        rows = self._rows()
+        self.assertEqual(rows[0], file_sort.CSV_LOG_HEADER)
+        self.assertEqual([r[1] for r in rows[1:]], ["old.pdf", "new.pdf", "c.pdf"])
+        self.assertTrue(all(len(r) == len(file_sort.CSV_LOG_HEADER) for r in rows))
+
+    def test_trailing_blank_line_does_not_reverse_oldest_first_log(self):
+        self.log_file_path.write_text(
+            "DateTime,Old Filename,New Filename,Destination,Manual Update Notes\n"
+            "2025-01-01 10:00:00,old.pdf,Old.pdf,Misc.,\n"
+            "2025-02-01 10:00:00,new.pdf,New.pdf,Misc.,\n"
+            "\n",
+            encoding="utf-8",
+        )
+        self._log_moves("c.pdf")
+        rows = self._rows()
+        self.assertEqual([r[1] for r in rows[1:]], ["old.pdf", "new.pdf", "c.pdf"])
+        self.assertNotIn(["", "", "", "", ""], rows)
+
+    def test_unreadable_legacy_log_is_appended_to_as_is(self):
+        legacy = "DateTime,Old Filename,New Filename,Destination\n2025-01-01 10:00:00,caf\xe9.pdf,Cafe.pdf,Misc.\n"
+        self.log_file_path.write_bytes(legacy.encode("cp1252"))
+        self._log_moves("a.pdf")
+        self.assertTrue(self.log_file_path.read_bytes().startswith(legacy.encode("cp1252")))
+        self.assertIn(b"a.pdf,A.PDF,Misc.", self.log_file_path.read_bytes())
+
+    def test_read_log_sorted_is_newest_first(self):
+        self._log_moves("a.pdf", "b.pdf", "c.pdf")
+        rows = file_sort.read_log_sorted(self.log_file_path)
+        self.assertEqual([r[1] for r in rows], ["c.pdf", "b.pdf", "a.pdf"])
+
+    def _flaky_log(self, move_log, failures):
+        """Make the next `failures` raw writes fail with the iCloud EDEADLK."""
+        raw = move_log._raw
+        remaining = [failures]
+
+        def write(data):
+            if remaining[0]:
+                remaining[0] -= 1
+                raise OSError(11, "Resource deadlock avoided")
+            return raw.write(data)
+
+        move_log._raw = SimpleNamespace(write=write, close=raw.close)
+
+    def test_row_write_retries_on_icloud_lock(self):
+        with patch.object(file_sort.time, "sleep"):
+            with file_sort.open_move_log(self.log_file_path) as f:
+                self._flaky_log(f, failures=2)
+                file_sort.log_file_move(csv.writer(f), "a.pdf", "A.pdf", "Misc.")
+                self.assertEqual([r[1] for r in self._rows()[1:]], ["a.pdf"])
+
+    def test_rows_kept_until_lock_clears(self):
+        attempts = file_sort.CSV_LOCK_ATTEMPTS
+        with patch.object(file_sort.time, "sleep"):
+            with file_sort.open_move_log(self.log_file_path) as f:
+                # First row exhausts its retries; it's written with the second
+                self._flaky_log(f, failures=attempts)
+                writer = csv.writer(f)
+                file_sort.log_file_move(writer, "a.pdf", "A.pdf", "Misc.")
+                self.assertEqual(self._rows(), [file_sort.CSV_LOG_HEADER])
+                file_sort.log_file_move(writer, "b.pdf", "B.pdf", "Misc.")
+        self.assertEqual([r[1] for r in self._rows()[1:]], ["a.pdf", "b.pdf"])
+
+
+class TestProcessOneFile(unittest.TestCase):
+    """Runs the per-file pipeline with extraction and call_claude mocked."""
+
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.inbox = self.tmp / "00 - Scan Inbox"
+        self.inbox.mkdir()
+        (self.tmp / "Misc.").mkdir()
+        bills = self.tmp / "Financial" / "Bills"
+        bills.mkdir(parents=True)
+        for b in ["HOA", "Electric", "Gas"]:
+            (bills / b).mkdir()
+        self.log_file_path = self.inbox / "file_move_log.csv"
+        self.move_log = open(self.log_file_path, "a", newline="", encoding="utf-8")
+        self.log_writer = csv.writer(self.move_log)
+
+        self.patches = [
+            patch.object(file_sort, "DOCUMENTS_BASE_PATH", self.tmp),
+            patch.object(file_sort, "log_print"),
+            patch.object(file_sort, "_nudge_icloud"),
+            patch.object(file_sort, "extract_text_from_pdf", return_value="Electric bill for January"),
+            patch.object(file_sort, "get_file_created_date", return_value="2025-01-20"),
+            patch.object(file_sort, "call_claude", side_effect=self._fake_claude),
+            patch.object(file_sort, "LLM_CACHE_PATH", self.tmp / "cache" / "llm_cache.json"),
+            patch.object(file_sort, "_LLM_CACHE", None),
+            patch.object(file_sort, "CLASSIFY_RULES_PATH", self.tmp / "config" / "rules.json"),
+            patch.object(file_sort, "_CREATED_FOLDERS", set()),
+            patch.object(file_sort, "_SEEN_DOCUMENTS", {}),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in reversed(self.patches):
+            p.stop()
+        self.move_log.close()
+        shutil.rmtree(self.tmp)
+
+    @staticmethod
+    def _fake_claude(prompt):
+        if "ONE root folder" in prompt:
+            return "Financial"
+        if '"filename"' in prompt:
+            return '{"path": "Financial/Bills/Electric", "filename": "2025-01-15 - Electric Bill January"}'
+        if "destination path" in prompt:
+            return "Financial/Bills/Electric"
+        return "2025-01-15 - Electric Bill January"
+
+    def test_file_is_renamed_and_moved(self):
+        pdf = self.inbox / "scan001.pdf"
+        pdf.write_bytes(b"%PDF-1.4")
+        file_sort.process_one_file(pdf, self.log_writer)
+        self.move_log.flush()
+        moved = self.tmp / "Financial" / "Bills" / "Electric" / "2025-01-15 - Electric Bill January.pdf"
+        self.assertTrue(moved.exists())
+        self.assertFalse(pdf.exists())
+        self.assertIn("scan001.pdf", self.log_file_path.read_text(encoding="utf-8"))
+
+    def test_already_named_file_keeps_its_name(self):
+        pdf = self.inbox / "2025-01-20 - Electric Bill.pdf"
+        pdf.write_bytes(b"%PDF-1.4")
+        file_sort.process_one_file(pdf, self.log_writer)
+        moved = self.tmp / "Financial" / "Bills" / "Electric" / "2025-01-20 - Electric Bill.pdf"
+        self.assertTrue(moved.exists())
+        prompts = [c.args[0] for c in file_sort.call_claude.call_args_list]
+        self.assertFalse(any('"filename"' in p for p in prompts))
+
+    def test_concurrent_workers_never_clobber_same_target_name(self):
+        # Both scans get the same suggested name; the second must be left in
+        # the inbox rather than overwriting the first.
+        pdfs = []
+        for i in range(2):
+            pdf = self.inbox / f"scan00{i}.pdf"
+            pdf.write_bytes(f"%PDF-1.4 {i}".encode())
+            pdfs.append(pdf)
+        # Different text, so they aren't treated as duplicate scans
+        file_sort.extract_text_from_pdf.side_effect = lambda pdf: f"Electric bill {pdf.name}"
+        stop_event = threading.Event()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(
+                lambda pdf: file_sort._process_file_worker(pdf, self.log_writer, stop_event),
+                pdfs,
+            ))
+        electric = self.tmp / "Financial" / "Bills" / "Electric"
+        remaining = [p for p in self.inbox.iterdir() if p.suffix == ".pdf"]
+        self.assertEqual(len(list(electric.iterdir())), 1)
+        self.assertEqual(len(remaining), 1)
+
+    def test_destination_folder_is_created_once_per_run(self):
+        dest = self.tmp / "Financial" / "Bills" / "Water"
+        real_mkdir = Path.mkdir
+        with patch.object(Path, "mkdir", autospec=True, side_effect=real_mkdir) as mkdir:
+            for i in range(2):
+                pdf = self.inbox / f"scan00{i}.pdf"
+                pdf.write_bytes(b"%PDF-1.4")
+                self.assertTrue(file_sort.move_file_to_destination(pdf, dest, self.log_writer))
+        self.assertEqual(mkdir.call_count, 1)
+        self.assertEqual(len(list(dest.iterdir())), 2)
+
+    def test_new_folder_invalidates_cached_tree(self):
+        financial = self.tmp / "Financial"
+        self.assertNotIn("2026", file_sort.build_annotated_tree(financial))
+        pdf = self.inbox / "scan001.pdf"
+        pdf.write_bytes(b"%PDF-1.4")
+        file_sort.move_file_to_destination(pdf, financial / "Receipts" / "2026", self.log_writer)
+        self.assertIn("2026/", file_sort.build_annotated_tree(financial))
+
+    def test_move_never_overwrites_existing_file(self):
+        source = self.inbox / "scan001.pdf"
+        source.write_bytes(b"%PDF-1.4 new")
+        target = self.tmp / "Misc." / "scan001.pdf"
+        target.write_bytes(b"%PDF-1.4 old")
+        with self.assertRaises(FileExistsError):
+            file_sort._move_no_clobber(source, target)
+        self.assertEqual(target.read_bytes(), b"%PDF-1.4 old")
+        self.assertTrue(source.exists())
+
+    def test_rename_skips_taken_name(self):
+        pdf = self.inbox / "scan001.pdf"
+        pdf.write_bytes(b"%PDF-1.4")
+        (self.inbox / "2025-01-15 - Bill.pdf").write_bytes(b"%PDF-1.4 other")
+        self.assertEqual(file_sort.rename_file(pdf, "2025-01-15 - Bill.pdf"), pdf)
+        self.assertTrue(pdf.exists())
+
+    def test_iter_pdfs_lists_visible_pdfs_only(self):
+        for name in ["a.pdf", "B.PDF", ".hidden.pdf", "notes.txt"]:
+            (self.inbox / name).write_bytes(b"x")
+        (self.inbox / "folder.pdf").mkdir()
+        self.assertEqual(
+            sorted(p.name for p in file_sort.iter_pdfs(self.inbox)),
+            ["B.PDF", "a.pdf"],
+        )
+
+    def test_iter_pdfs_follows_symlinked_pdfs(self):
+        target = self.tmp / "elsewhere.pdf"
+        target.write_bytes(b"%PDF-1.4")
+        (self.inbox / "linked.pdf").symlink_to(target)
+        self.assertEqual([p.name for p in file_sort.iter_pdfs(self.inbox)], ["linked.pdf"])
+
+    def test_duplicate_scan_reuses_classification(self):
+        pdfs = []
+        for i in range(2):
+            pdf = self.inbox / f"scan00{i}.pdf"
+            pdf.write_bytes(b"%PDF-1.4")
+            pdfs.append(pdf)
+        for pdf in pdfs:
+            file_sort.process_one_file(pdf, self.log_writer)
+        electric = self.tmp / "Financial" / "Bills" / "Electric"
+        self.assertEqual(
+            sorted(p.name for p in electric.iterdir()),
+            ["2025-01-15 - Electric Bill January (2).pdf", "2025-01-15 - Electric Bill January.pdf"],
+        )
+        # Root pick + combined call, once for both copies
+        self.assertEqual(file_sort.call_claude.call_count, 2)
+
+    def test_concurrent_duplicate_scans_are_both_filed(self):
+        # Hold the original copy back until the duplicate has been moved, so
+        # the duplicate claims a name before the original's file exists
+        pdfs = []
+        for i in range(2):
+            pdf = self.inbox / f"scan00{i}.pdf"
+            pdf.write_bytes(b"%PDF-1.4")
+            pdfs.append(pdf)
+        moved = threading.Event()
+        local = threading.local()
+        real_move = file_sort.move_file_to_destination
+
+        def move(*args, **kwargs):
+            try:
+                return real_move(*args, **kwargs)
+            finally:
+                moved.set()
+
+        def log(message="", *args, **kwargs):
+            if str(message).startswith("[DEDUP]"):
+                local.duplicate = True
+            elif str(message).startswith("Suggested filename") and not getattr(local, "duplicate", False):
+                moved.wait(timeout=5)
+
+        file_sort.log_print.side_effect = log
+        stop_event = threading.Event()
+        with patch.object(file_sort, "move_file_to_destination", side_effect=move):
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                list(executor.map(
+                    lambda pdf: file_sort._process_file_worker(pdf, self.log_writer, stop_event),
+                    pdfs,
+                ))
+        electric = self.tmp / "Financial" / "Bills" / "Electric"
+        self.assertEqual(
+            sorted(p.name for p in electric.iterdir()),
+            ["2025-01-15 - Electric Bill January (2).pdf", "2025-01-15 - Electric Bill January.pdf"],
+        )
+        self.assertFalse(any(p.suffix == ".pdf" for p in self.inbox.iterdir()))
+
+    def test_same_first_pages_different_size_are_not_duplicates(self):
+        for i, size in enumerate([10, 20]):
+            pdf = self.inbox / f"scan00{i}.pdf"
+            pdf.write_bytes(b"%PDF-1.4" + b" " * size)
+            file_sort.process_one_file(pdf, self.log_writer)
+        messages = [c.args[0] for c in file_sort.log_print.call_args_list if c.args]
+        self.assertFalse(any(str(m).startswith("[DEDUP]") for m in messages))
+
+    def test_interrupt_cancels_queued_files(self):
+        pdfs = []
+        for i in range(4):
+            pdf = self.inbox / f"scan00{i}.pdf"
+            pdf.write_bytes(b"%PDF-1.4")
+            pdfs.append(pdf)
+
+        # Ctrl-C arrives while main() waits on the first file, which is
+        # still in progress
+        with patch.object(file_sort, "MAX_CONCURRENT_FILES", 1), \
+                patch.object(file_sort, "process_one_file", side_effect=lambda *args: time.sleep(0.2)) as process, \
+                patch("concurrent.futures.Future.result", side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                file_sort.process_files(pdfs, self.log_writer)
+        self.assertEqual(process.call_count, 1)
+
+    def test_worker_lines_are_tagged_with_file_name(self):
+        pdf = self.inbox / "scan001.pdf"
+        lines = []
+        handler = logging.Handler()
+        handler.setFormatter(logging.Formatter(file_sort._LOG_FORMAT))
+        handler.emit = lambda record: lines.append(handler.format(record))
+        file_sort._logger.addHandler(handler)
+        self.addCleanup(file_sort._logger.removeHandler, handler)
+
+        def process(pdf_file, log_writer):
+            file_sort._logger.warning("OCR is slow")
+
+        with patch.object(file_sort, "process_one_file", side_effect=process), \
+                patch.object(file_sort._console_handler, "stream", io.StringIO()):
+            file_sort._process_file_worker(pdf, self.log_writer, threading.Event())
+            file_sort._logger.warning("run finished")
+        self.assertEqual(lines, ["[scan001.pdf] OCR is slow", "run finished"])
+
+    def test_worker_skips_files_after_usage_limit(self):
+        pdf = self.inbox / "scan001.pdf"
+        pdf.write_bytes(b"%PDF-1.4")
+        stop_event = threading.Event()
+        stop_event.set()
+        file_sort._process_file_worker(pdf, self.log_writer, stop_event)
+        file_sort.extract_text_from_pdf.assert_not_called()
+        self.assertTrue(pdf.exists())
+
+
+
+class TestTimedMemoryHandler(unittest.TestCase):
+    def test_idle_buffer_is_flushed_by_timer(self):
+        tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, tmp)
+        target = logging.FileHandler(tmp / "debug.log", encoding="utf-8")
+        handler = file_sort._TimedMemoryHandler(256, 0.05, target=target)
+        self.addCleanup(target.close)
+        self.addCleanup(handler.close)
+        logger = logging.getLogger("file_sort.test_timed_flush")
+        logger.propagate = False
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+
+        logger.warning("first line")  # flushLevel defaults to ERROR
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline and "first line" not in (tmp / "debug.log").read_text():
+            time.sleep(0.01)
+        self.assertIn("first line", (tmp / "debug.log").read_text())
+
+
 if __name__ == "__main__":
     unittest.main()